@@ -0,0 +1,196 @@
+"""
+app/anomaly.py  · 流式异常检测
+
+按 (Building, Floor) 电表、按相维护 EWMA 均值/方差与上一样本，
+每个新样本 O(1) 更新并判断：越限、偏离基线、突变、三相不平衡。
+"""
+
+import math
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import config
+from .utils import UNKNOWN_BUILDING, to_float_safe, parse_row_time
+
+PHASE_FIELDS = tuple(f"{kind}{phase}" for kind in ("volt", "current", "power") for phase in "123")
+
+MeterKey = Tuple[str, Optional[int]]
+
+
+class EwmaState:
+    """单个字段的指数加权均值/方差与上一样本"""
+
+    __slots__ = ("mean", "var", "count", "last_value", "last_time")
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+        self.last_value: Optional[float] = None
+        self.last_time: Optional[datetime] = None
+
+    def update(self, value: float, t: datetime, alpha: float):
+        self.count += 1
+        if self.count == 1:
+            self.mean = value
+        else:
+            diff = value - self.mean
+            incr = alpha * diff
+            self.mean += incr
+            self.var = (1 - alpha) * (self.var + diff * incr)
+        self.last_value = value
+        self.last_time = t
+
+
+class MeterState:
+    """单块电表的全部检测状态"""
+
+    __slots__ = ("last_time", "fields", "active")
+
+    def __init__(self):
+        self.last_time: Optional[datetime] = None
+        self.fields: Dict[str, EwmaState] = {f: EwmaState() for f in PHASE_FIELDS}
+        self.active: set = set()   # 当前处于异常中的 (kind, field)，用于只在进入异常时记一次事件
+
+
+def _imbalance(values: List[float]) -> Tuple[float, float]:
+    """返回 (三相均值, 最大偏差/均值)"""
+    avg = sum(values) / len(values)
+    if avg <= 0:
+        return avg, 0.0
+    return avg, max(abs(v - avg) for v in values) / avg
+
+
+class AnomalyDetector:
+    """
+    线程安全的流式异常检测器，observe() 喂入新抓取的 data_value 行。
+    只应喂新行（共享缓存跟读、/latest），不要把大范围的历史查询结果整批喂进来
+    """
+
+    def __init__(self,
+                 alpha: float = config.ANOMALY_EWMA_ALPHA,
+                 max_events: int = config.ANOMALY_MAX_EVENTS):
+        self.alpha = alpha
+        self._meters: Dict[MeterKey, MeterState] = {}
+        self._events: deque = deque(maxlen=max_events)
+        self._samples = 0
+        self._lock = threading.Lock()
+
+    # ---- 判断 ----
+
+    def _emit(self, meter: MeterState, key: MeterKey, t: datetime,
+              kind: str, field: str, anomalous: bool, **detail):
+        """边沿触发：只在进入异常时记录事件，恢复正常后才允许再次记录"""
+        tag = (kind, field)
+        if not anomalous:
+            meter.active.discard(tag)
+            return
+        if tag in meter.active:
+            return
+        meter.active.add(tag)
+        event = {
+            "time": t.strftime("%Y-%m-%d %H:%M:%S"),
+            "Building": key[0],
+            "Floor": key[1],
+            "kind": kind,
+            "field": field,
+        }
+        event.update(detail)
+        self._events.append(event)
+
+    def _check_field(self, meter: MeterState, key: MeterKey, t: datetime,
+                     field: str, value: float):
+        state = meter.fields[field]
+
+        if field.startswith("volt"):
+            low, high = config.ANOMALY_VOLT_BAND
+            self._emit(meter, key, t, "out_of_band", field, not low <= value <= high,
+                       value=value, band=[low, high])
+
+        if state.count >= config.ANOMALY_WARMUP_SAMPLES:
+            std = math.sqrt(state.var)
+            z = abs(value - state.mean) / std if std >= config.ANOMALY_MIN_STD else 0.0
+            self._emit(meter, key, t, "deviation", field, z > config.ANOMALY_Z_THRESHOLD,
+                       value=value, expected=round(state.mean, 3), z=round(z, 2))
+
+        if state.last_value is not None and state.last_time is not None:
+            dt = (t - state.last_time).total_seconds()
+            if 0 < dt <= config.ANOMALY_STEP_WINDOW:
+                step = value - state.last_value
+                level = max(abs(state.mean), config.ANOMALY_STEP_MIN_LEVEL)
+                self._emit(meter, key, t, "step", field,
+                           abs(step) > config.ANOMALY_STEP_RATIO * level,
+                           value=value, previous=state.last_value,
+                           rate_per_min=round(step / dt * 60, 3))
+
+        state.update(value, t, self.alpha)
+
+    def _check_imbalance(self, meter: MeterState, key: MeterKey, t: datetime,
+                         kind: str, values: List[float], threshold: float, min_avg: float):
+        avg, ratio = _imbalance(values)
+        self._emit(meter, key, t, "imbalance", kind,
+                   avg >= min_avg and ratio > threshold,
+                   values=values, ratio=round(ratio, 4))
+
+    # ---- 对外接口 ----
+
+    def observe(self, rows: Iterable[Dict]) -> int:
+        """喂入一批原始行（任意顺序），已处理过的旧样本会被跳过；返回新处理的样本数"""
+        samples = []
+        for row in rows:
+            t = parse_row_time(row)
+            if t is not None:
+                samples.append((t, row))
+        samples.sort(key=lambda s: s[0])
+
+        processed = 0
+        with self._lock:
+            for t, row in samples:
+                building = row.get("Building") or UNKNOWN_BUILDING
+                try:
+                    floor = int(row.get("Floor"))
+                except (ValueError, TypeError):
+                    floor = None
+                key = (building, floor)
+                meter = self._meters.get(key)
+                if meter is None:
+                    meter = self._meters[key] = MeterState()
+                if meter.last_time is not None and t <= meter.last_time:
+                    continue
+                meter.last_time = t
+
+                values = {f: to_float_safe(row.get(f, 0)) for f in PHASE_FIELDS}
+                for field, value in values.items():
+                    self._check_field(meter, key, t, field, value)
+                self._check_imbalance(meter, key, t, "volt",
+                                      [values["volt1"], values["volt2"], values["volt3"]],
+                                      config.ANOMALY_VOLT_IMBALANCE, 0.0)
+                self._check_imbalance(meter, key, t, "current",
+                                      [values["current1"], values["current2"], values["current3"]],
+                                      config.ANOMALY_CURRENT_IMBALANCE,
+                                      config.ANOMALY_IMBALANCE_MIN_CURRENT)
+                processed += 1
+            self._samples += processed
+        return processed
+
+    def events(self, limit: int,
+               buildings: Optional[Sequence[str]] = None,
+               floors: Optional[Sequence[int]] = None) -> List[Dict]:
+        """最近的异常事件（新 → 旧），可按楼栋/楼层过滤"""
+        with self._lock:
+            result = []
+            for event in reversed(self._events):
+                if buildings and event["Building"] not in buildings:
+                    continue
+                if floors and event["Floor"] not in floors:
+                    continue
+                result.append(event)
+                if len(result) >= limit:
+                    break
+            return result
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {"meters": len(self._meters), "samples": self._samples}
@@ -19,3 +19,55 @@ TIMEOUT    = 30    # 秒
 # API 默认
 DEFAULT_LIMIT = 5
 MAX_LIMIT     = 100
+
+# 统计草图（/stats）
+STATS_BUCKET_MINUTES     = 30      # 每个汇总桶覆盖的分钟数
+STATS_MAX_DAYS           = 31      # /stats 最大查询跨度（天）
+STATS_MAX_BUCKETS        = 1536    # 每个 worker 内存中最多保留的已关闭桶（(31 + 1) 天 × 48）；
+                                   # 60 块电表时约 19 MB/天，满载约 600 MB/worker，内存紧张时调小（只影响命中率）
+STATS_CLOSE_GRACE_SECONDS = 120    # 桶结束后再等待该秒数才视为关闭并缓存（应大于 SHARED_CACHE_MAX_LAG_SECONDS）
+STATS_FETCH_MAX_BUCKETS  = 48      # 单次回源最多覆盖的桶数
+STATS_SKETCH_ALPHA       = 0.01    # 分位数草图相对误差
+STATS_DEFAULT_QUANTILES  = "0.5,0.95,0.99"
+
+# 异常检测（/anomalies）
+ANOMALY_EWMA_ALPHA         = 0.1              # EWMA 平滑系数
+ANOMALY_WARMUP_SAMPLES     = 20               # 基线预热样本数，之前不做偏离判断
+ANOMALY_Z_THRESHOLD        = 4.0              # 偏离基线的 z 分数阈值
+ANOMALY_MIN_STD            = 1e-3             # 标准差过小时不做 z 分数判断
+ANOMALY_STEP_RATIO         = 0.5              # 相邻样本跳变超过基线的比例视为突变
+ANOMALY_STEP_WINDOW        = 600              # 相邻样本间隔超过该秒数不判断突变
+ANOMALY_STEP_MIN_LEVEL     = 1.0              # 基线过小时按此值计算突变比例
+ANOMALY_VOLT_BAND          = (207.0, 253.0)   # 电压允许范围（230V ±10%）
+ANOMALY_VOLT_IMBALANCE     = 0.02             # 三相电压不平衡度阈值
+ANOMALY_CURRENT_IMBALANCE  = 0.2              # 三相电流不平衡度阈值
+ANOMALY_IMBALANCE_MIN_CURRENT = 1.0           # 平均电流低于该值时不判断电流不平衡
+ANOMALY_MAX_EVENTS         = 1000             # 内存中保留的最近事件数
+
+# 多 worker 共享缓存（SQLite WAL，单一选举出的回源 worker）
+SHARED_CACHE_ENABLED          = True
+SHARED_CACHE_PATH             = "power_monitor_cache.sqlite3"   # 锁文件为 PATH + ".lock"
+SHARED_CACHE_POLL_SECONDS     = 30     # 回源增量拉取间隔
+SHARED_CACHE_RETENTION_DAYS   = 31     # 缓存保留天数（覆盖 /monthly 与 /stats）
+SHARED_CACHE_BACKFILL_HOURS   = 24     # 回填历史数据时每轮拉取的跨度
+SHARED_CACHE_INITIAL_HOURS    = 25     # 首轮拉取的跨度，需覆盖预热的 /half-hourly/summary 窗口（24.5 小时）
+SHARED_CACHE_OVERLAP_SECONDS  = 60     # 增量拉取与上次水位的重叠，防止漏掉迟到的行
+SHARED_CACHE_MAX_LAG_SECONDS  = 90     # 水位落后当前时间超过该值时，涉及"现在"的查询回源
+
+# 回源熔断与响应缓存（stale-while-revalidate）
+BREAKER_FAILURE_THRESHOLD = 3      # 连续失败次数达到该值后熔断
+BREAKER_COOLDOWN          = 60     # 熔断后暂停回源的秒数，之后放行一次试探请求
+RESPONSE_TTL_SECONDS      = 30     # 响应缓存在该时间内视为新鲜
+RESPONSE_MAX_STALE_SECONDS = 86400 # 过期超过该时间的响应不再作为陈旧结果返回
+RESPONSE_MAX_ENTRIES      = 512    # 响应缓存最多条目数
+
+# 启动预热（/ready）
+PMA_SESSION_POOL_SIZE      = 4     # 保持登录状态的 phpMyAdmin 会话数
+WARMUP_ENABLED             = True
+WARMUP_CACHE_WAIT_SECONDS  = 30    # 预热前最多等待共享缓存完成首轮拉取的秒数
+
+# 用电量（/consumption，基于累计电能 energy1..3 的首末读数差）
+CONSUMPTION_MAX_DAYS        = 366   # /consumption 最大查询跨度（天）
+CONSUMPTION_HOURLY_MAX_DAYS = 31    # bucket=hour 时的最大查询跨度（天），避免首末读数超过单次查询的行数上限
+CONSUMPTION_JITTER_RATIO    = 0.01  # 读数回落不超过前一读数的该比例视为抖动：记 0，保留原参考读数
+CONSUMPTION_RESET_RATIO     = 0.1   # 读数降到前一读数的该比例以下视为计数器回零；介于两者之间视为换表，以新读数为参考、记 0
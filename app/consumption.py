@@ -0,0 +1,120 @@
+"""
+app/consumption.py  · 基于累计电能计数器的用电量
+
+data_value 的 energy1..3 是累计电能（kWh）。某段时间的用电量只需要每块电表在
+每个桶内的首、末读数：相邻读数之差即为这段时间的用电量，代价与 电表数 × 桶数 成正比，
+与原始行数无关。
+
+* 读数回落不超过 CONSUMPTION_JITTER_RATIO：视为读数抖动，本段记 0，之后仍以回落前的读数为准
+* 计数器回零（后一读数低于前一读数的 CONSUMPTION_RESET_RATIO）：视为从 0 重新累计，
+  本段用电量取后一读数
+* 介于两者之间的回落（换表、计数器重装为较小的值）：本段记 0，之后以新读数为参考
+* 跨桶/数据缺口：桶 k 的末读数与桶 k+1 的首读数之差计入后一个桶，总量不丢失
+* 任一相电能为 0 的读数视为无效读数跳过（回源/共享缓存查询首末读数时已排除），
+  避免把单相掉线误算成一次回零
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import config
+from .utils import UNKNOWN_BUILDING, to_float_safe, parse_row_time
+
+# 分桶格式：同时适用于 Python strftime、MySQL DATE_FORMAT 与 SQLite strftime
+BUCKET_FORMATS = {
+    "none": "",
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+ENERGY_FIELDS = ("energy1", "energy2", "energy3")
+
+MeterKey = Tuple[str, Optional[int]]
+
+
+def _meter_key(row: Dict) -> MeterKey:
+    building = row.get("Building") or UNKNOWN_BUILDING
+    try:
+        floor = int(row.get("Floor"))
+    except (ValueError, TypeError):
+        floor = None
+    return building, floor
+
+
+def _readings(rows: Iterable[Dict]) -> Dict[MeterKey, List[Tuple[datetime, List[float]]]]:
+    """按电表分组、按时间排序并去重的有效读数"""
+    meters: Dict[MeterKey, Dict[datetime, List[float]]] = {}
+    for row in rows:
+        t = parse_row_time(row)
+        if t is None:
+            continue
+        values = [to_float_safe(row.get(f, 0)) for f in ENERGY_FIELDS]
+        if min(values) <= 0:
+            continue
+        meters.setdefault(_meter_key(row), {}).setdefault(t, values)
+    return {key: sorted(readings.items()) for key, readings in meters.items()}
+
+
+def _empty() -> Dict:
+    return {"total": 0.0, "phases": [0.0, 0.0, 0.0], "floors": {}}
+
+
+def _add(target: Dict, floor: Optional[int], deltas: List[float]):
+    total = sum(deltas)
+    target["total"] += total
+    for i, d in enumerate(deltas):
+        target["phases"][i] += d
+    floor_key = str(floor) if floor is not None else "null"
+    target["floors"][floor_key] = target["floors"].get(floor_key, 0.0) + total
+
+
+def compute_consumption(rows: Iterable[Dict], bucket: str) -> Dict:
+    """
+    由首末读数计算用电量（kWh）。
+
+    Returns:
+        {"totals": {Building: {...}}, "buckets": {bucket_key: {Building: {...}}},
+         "meters": 电表数, "resets": 回零次数, "rebases": 换表（重新取参考读数）次数}
+        其中 {...} 为 {"total": kWh, "phases": [相1, 相2, 相3], "floors": {Floor: kWh}}
+    """
+    fmt = BUCKET_FORMATS[bucket]
+    totals: Dict[str, Dict] = {}
+    buckets: Dict[str, Dict[str, Dict]] = {}
+    resets = 0
+    rebases = 0
+
+    readings = _readings(rows)
+    for (building, floor), series in readings.items():
+        base = list(series[0][1])     # 每相的参考读数
+        for t, cur in series[1:]:
+            deltas = []
+            for i, c in enumerate(cur):
+                p = base[i]
+                if c >= p:
+                    deltas.append(c - p)
+                    base[i] = c
+                elif c >= p * (1 - config.CONSUMPTION_JITTER_RATIO):
+                    # 读数小幅回落：视为抖动，记 0 并保留原参考读数，之后从原读数继续计算
+                    deltas.append(0.0)
+                elif c < p * config.CONSUMPTION_RESET_RATIO:
+                    # 计数器回零：从 0 重新累计
+                    resets += 1
+                    deltas.append(c)
+                    base[i] = c
+                else:
+                    # 换表/计数器重装：无法得知这段的用电量，记 0 并以新读数为参考
+                    rebases += 1
+                    deltas.append(0.0)
+                    base[i] = c
+            bucket_key = t.strftime(fmt) if fmt else "all"
+            _add(buckets.setdefault(bucket_key, {}).setdefault(building, _empty()), floor, deltas)
+            _add(totals.setdefault(building, _empty()), floor, deltas)
+
+    return {
+        "totals": dict(sorted(totals.items())),
+        "buckets": dict(sorted(buckets.items())),
+        "meters": len(readings),
+        "resets": resets,
+        "rebases": rebases,
+    }
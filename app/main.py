@@ -1,14 +1,26 @@
-from typing import List, Dict, Optional
-from fastapi import FastAPI, Query, HTTPException, Depends
+from typing import List, Dict, NamedTuple, Optional, Sequence, Tuple
+from fastapi import FastAPI, Query, HTTPException, Depends, Response
 from fastapi.responses import JSONResponse
 from starlette.concurrency import run_in_threadpool
 from datetime import datetime, timedelta
 from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
 import math
 
 from . import config
-from .pma_client import fetch_latest, fetch_by_time_range
+from .pma_client import (
+    fetch_latest, fetch_by_time_range, fetch_boundary_rows, preload_parser, warm_up_sessions,
+    breaker_state
+)
 from .models import DataRecord
+from .stats import BucketStore, parse_quantiles
+from .anomaly import AnomalyDetector
+from .shared_cache import SharedCache
+from .resilience import SWRCache, CircuitOpenError, cache_headers
+from .utils import parse_row_time
+from .warmup import WarmUp
+from .consumption import BUCKET_FORMATS, compute_consumption
 
 DESC = """
 MUT Power Monitor · Demo API
@@ -28,14 +40,117 @@ MUT Power Monitor · Demo API
 * `/daily-stats/summary` — 最近10天内每天按楼栋统计的有功功率汇总
 * `/half-hourly/summary` — 24小时内每半小时的楼栋有功功率汇总
 * `/test/half-hourly/summary` — 测试API：指定时间24小时内每半小时的楼栋有功功率汇总
+* `/stats`              — 自定义时间范围内按楼栋的功率/电压/电流统计（峰值、均值、分位数，最长31天）
+* `/anomalies`          — 流式异常检测最近的事件（越限、偏离基线、突变、三相不平衡）
+* `/ready`              — 启动预热进度（预热完成前返回 503，供负载均衡器探活）
+* `/consumption`        — 自定义时间范围内按楼栋/楼层/相的用电量 kWh（基于累计电能首末读数，最长366天，按小时分桶最长31天）
 """
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    启动：开启共享缓存后台线程（多 worker 时只有选举出的 leader 回源），
+    并在后台执行预热，不阻塞服务开始监听（/ready 报告进度）。
+    """
+    if config.SHARED_CACHE_ENABLED:
+        _shared_cache.start(fetch_by_time_range, on_rows=_detector.observe)
+    warmup_task = None
+    if config.WARMUP_ENABLED:
+        warmup_task = asyncio.create_task(_warmup.run(_warmup_steps()))
+    else:
+        _warmup.skip()
+    yield
+    if warmup_task is not None:
+        warmup_task.cancel()
+    if config.SHARED_CACHE_ENABLED:
+        _shared_cache.stop()
+
+
 app = FastAPI(
     title="MUT Power Monitor API",
     version="0.5.0",
     description=DESC,
+    lifespan=lifespan,
 )
 
+# 已关闭时间桶的统计草图缓存（/stats）
+_bucket_store = BucketStore()
+
+# 流式异常检测：只喂新行（共享缓存跟读到的新行、/latest 取到的最近 N 行）
+_detector = AnomalyDetector()
+
+# 多 worker 共享的 SQLite 行缓存
+_shared_cache = SharedCache()
+
+# 响应级 stale-while-revalidate 缓存：上游变慢/故障时先返回上次的结果
+_response_cache = SWRCache()
+
+# 启动预热进度
+_warmup = WarmUp()
+
+
+def _upstream_error(e: Exception) -> HTTPException:
+    """熔断中返回 503（带 Retry-After），其余回源异常返回 500"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(status_code=503, detail=str(e),
+                             headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+    return HTTPException(status_code=500, detail=str(e))
+
+
+class RowFilter(NamedTuple):
+    """Building/Floor 多值过滤（None 表示不过滤）；可哈希，直接用作响应缓存 key 的一部分"""
+    buildings: Optional[Tuple[str, ...]] = None
+    floors: Optional[Tuple[int, ...]] = None
+
+
+def _row_filter(
+    building: Optional[List[str]] = Query(None, description="只返回这些楼栋（可重复传参：building=A&building=B）"),
+    floor: Optional[List[int]] = Query(None, description="只返回这些楼层（可重复传参：floor=1&floor=2）")
+) -> RowFilter:
+    return RowFilter(
+        tuple(sorted(set(building))) if building else None,
+        tuple(sorted(set(floor))) if floor else None,
+    )
+
+
+def _fetch_latest(n: int,
+                  buildings: Optional[Sequence[str]] = None,
+                  floors: Optional[Sequence[int]] = None) -> List[Dict]:
+    """取最近 N 行：优先读共享缓存，未命中再回源；过滤条件下推到查询；结果喂给异常检测器"""
+    rows = _shared_cache.read_latest(n, buildings, floors) if config.SHARED_CACHE_ENABLED else None
+    if rows is None:
+        rows = fetch_latest(n, buildings, floors)
+    _detector.observe(rows)
+    return rows
+
+
+def _fetch_range(start_time: datetime, end_time: datetime, limit: int = 1000000,
+                 buildings: Optional[Sequence[str]] = None,
+                 floors: Optional[Sequence[int]] = None) -> List[Dict]:
+    """
+    按时间范围取数：缓存水位覆盖时读共享缓存，否则回源；过滤条件下推到查询。
+    结果不喂给异常检测器：大范围查询几乎全是旧行，逐行解析只会白白占用检测器
+    """
+    rows = (_shared_cache.read_range(start_time, end_time, limit, buildings, floors)
+            if config.SHARED_CACHE_ENABLED else None)
+    if rows is None:
+        rows = fetch_by_time_range(start_time, end_time, limit, buildings, floors)
+    return rows
+
+
+def _fetch_boundaries(start_time: datetime, end_time: datetime, bucket_format: str,
+                      buildings: Optional[Sequence[str]] = None,
+                      floors: Optional[Sequence[int]] = None) -> List[Dict]:
+    """每块电表每个桶的首末记录：缓存水位覆盖时读共享缓存，否则回源（一次查询）"""
+    rows = (_shared_cache.read_boundaries(start_time, end_time, bucket_format, buildings, floors)
+            if config.SHARED_CACHE_ENABLED else None)
+    if rows is None:
+        rows = fetch_boundary_rows(start_time, end_time, bucket_format, buildings, floors)
+    return rows
+
 
 def _to_float_safe(value: str) -> float:
     """处理空字符串/异常值"""
@@ -87,8 +202,8 @@ def _process_raw_data(rows: List[Dict]) -> List[Dict]:
     return processed_rows
 
 
-async def _validate_date_range(start_date: str, end_date: str):
-    """验证日期范围是否有效且不超过7天"""
+async def _validate_date_range(start_date: str, end_date: str, max_days: int = 7):
+    """验证日期范围是否有效且不超过 max_days 天（默认7天）"""
     try:
         # 尝试解析日期，支持多种格式
         # 如果只有日期部分（没有时间），自动添加时间
@@ -112,37 +227,42 @@ async def _validate_date_range(start_date: str, end_date: str):
         raise HTTPException(status_code=400, detail="结束日期不能早于开始日期")
     
     delta = end_dt - start_dt
-    if delta.days > 7:
-        raise HTTPException(status_code=400, detail="时间范围不能超过7天")
+    if delta.days > max_days:
+        raise HTTPException(status_code=400, detail=f"时间范围不能超过{max_days}天")
     
     return start_dt, end_dt
 
 
 @app.get("/latest", response_model=List[DataRecord])
 async def latest(
+    response: Response,
     n: int = Query(
         config.DEFAULT_LIMIT,
         ge=1,
         le=config.MAX_LIMIT,
         description="返回行数 (1-100)"
-    )
+    ),
+    filters: RowFilter = Depends(_row_filter)
 ):
     """最近 N 行记录（用于测试和异常检测）"""
-    try:
-        rows = await run_in_threadpool(fetch_latest, n)
-        
+    async def compute():
+        rows = await run_in_threadpool(_fetch_latest, n, *filters)
+
         # 调试：打印第一行数据的字段
         if rows:
             print(f"Debug - First row keys: {list(rows[0].keys())}")
             print(f"Debug - First row: {rows[0]}")
-        
+
         # 确保数据格式正确
-        processed_rows = _process_raw_data(rows)
-        
+        return _process_raw_data(rows)
+
+    try:
+        processed_rows, age, stale = await _response_cache.get(("latest", n, filters), compute)
+        response.headers.update(cache_headers(age, stale))
         return processed_rows
     except Exception as e:
         print(f"Error in latest endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _upstream_error(e)
 
 
 @app.get("/summary")
@@ -152,361 +272,328 @@ async def summary(
         ge=1,
         le=config.MAX_LIMIT,
         description="汇总最近 N 行"
-    )
+    ),
+    filters: RowFilter = Depends(_row_filter)
 ):
     """最近 N 行 → 按楼栋统计累计有功功率(kW)。"""
+    async def compute():
+        rows = await run_in_threadpool(_fetch_latest, n, *filters)
+        return _aggregate_by_building(rows)
+
     try:
-        rows = await run_in_threadpool(fetch_latest, n)
-        agg = _aggregate_by_building(rows)
+        agg, age, stale = await _response_cache.get(("summary", n, filters), compute)
         # Grafana 可以直接用对象或转成 [{"Building":..., "total_kW":...}]
-        return JSONResponse(agg)
+        return JSONResponse(agg, headers=cache_headers(age, stale))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _upstream_error(e)
 
 
-@app.get("/hourly/tests", response_model=List[DataRecord])
-async def hourly_tests():
-    """最近一小时的全部原始数据"""
+async def _recent_tests(key: str, label: str, delta: timedelta, max_records: int, filters: RowFilter):
+    """
+    最近一段时间的全部原始数据（hourly/daily/weekly/monthly 共用）。
+    原始行可达数十万行，不进入响应缓存
+    """
     try:
         now = datetime.now()
-        one_hour_ago = now - timedelta(hours=1)
-        
-        # 设置一个较大的值来获取所有记录
-        max_records = 10000  # 假设一小时内的记录不会超过这个数量
-        
-        rows = await run_in_threadpool(fetch_by_time_range, one_hour_ago, now, max_records)
+        rows = await run_in_threadpool(_fetch_range, now - delta, now, max_records, *filters)
         processed_rows = _process_raw_data(rows)
-        
-        print(f"Debug - 最近一小时获取记录数: {len(processed_rows)}")
-        
+
+        print(f"Debug - 最近{label}获取记录数: {len(processed_rows)}")
+
         return processed_rows
     except Exception as e:
-        print(f"Error in hourly_tests endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        print(f"Error in {key} endpoint: {str(e)}")
+        raise _upstream_error(e)
 
 
-@app.get("/hourly/summary")
-async def hourly_summary():
-    """最近一小时 → 按楼栋统计累计有功功率(kW)。"""
-    try:
+async def _recent_summary(key: str, label: str, delta: timedelta, max_records: int, filters: RowFilter):
+    """最近一段时间 → 按楼栋统计累计有功功率(kW)（hourly/daily/weekly/monthly 共用）"""
+    async def compute():
         now = datetime.now()
-        one_hour_ago = now - timedelta(hours=1)
-        
-        # 设置一个较大的值来获取所有记录
-        max_records = 10000  # 假设一小时内的记录不会超过这个数量
-        
-        rows = await run_in_threadpool(fetch_by_time_range, one_hour_ago, now, max_records)
+        rows = await run_in_threadpool(_fetch_range, now - delta, now, max_records, *filters)
         agg = _aggregate_by_building(rows)
-        
-        print(f"Debug - 最近一小时汇总记录数: {len(rows)}")
-        
-        return JSONResponse(agg)
+
+        print(f"Debug - 最近{label}汇总记录数: {len(rows)}")
+
+        return agg
+
+    try:
+        agg, age, stale = await _response_cache.get((key, filters), compute)
+        return JSONResponse(agg, headers=cache_headers(age, stale))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _upstream_error(e)
+
+
+@app.get("/hourly/tests", response_model=List[DataRecord])
+async def hourly_tests(filters: RowFilter = Depends(_row_filter)):
+    """最近一小时的全部原始数据"""
+    # 假设一小时内的记录不会超过 10000
+    return await _recent_tests("hourly_tests", "一小时", timedelta(hours=1), 10000, filters)
+
+
+@app.get("/hourly/summary")
+async def hourly_summary(filters: RowFilter = Depends(_row_filter)):
+    """最近一小时 → 按楼栋统计累计有功功率(kW)。"""
+    return await _recent_summary("hourly_summary", "一小时", timedelta(hours=1), 10000, filters)
 
 
 @app.get("/daily/tests", response_model=List[DataRecord])
-async def daily_tests():
+async def daily_tests(filters: RowFilter = Depends(_row_filter)):
     """最近一天的全部原始数据"""
-    try:
-        now = datetime.now()
-        one_day_ago = now - timedelta(days=1)
-        
-        # 设置一个较大的值来获取所有记录
-        max_records = 50000  # 假设一天内的记录不会超过这个数量
-        
-        rows = await run_in_threadpool(fetch_by_time_range, one_day_ago, now, max_records)
-        processed_rows = _process_raw_data(rows)
-        
-        print(f"Debug - 最近一天获取记录数: {len(processed_rows)}")
-        
-        return processed_rows
-    except Exception as e:
-        print(f"Error in daily_tests endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    # 假设一天内的记录不会超过 50000
+    return await _recent_tests("daily_tests", "一天", timedelta(days=1), 50000, filters)
 
 
 @app.get("/daily/summary")
-async def daily_summary():
+async def daily_summary(filters: RowFilter = Depends(_row_filter)):
     """最近一天 → 按楼栋统计累计有功功率(kW)。"""
-    try:
-        now = datetime.now()
-        one_day_ago = now - timedelta(days=1)
-        
-        # 设置一个较大的值来获取所有记录
-        max_records = 50000  # 假设一天内的记录不会超过这个数量
-        
-        rows = await run_in_threadpool(fetch_by_time_range, one_day_ago, now, max_records)
-        agg = _aggregate_by_building(rows)
-        
-        print(f"Debug - 最近一天汇总记录数: {len(rows)}")
-        
-        return JSONResponse(agg)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await _recent_summary("daily_summary", "一天", timedelta(days=1), 50000, filters)
 
 
 @app.get("/weekly/tests", response_model=List[DataRecord])
-async def weekly_tests():
+async def weekly_tests(filters: RowFilter = Depends(_row_filter)):
     """最近一周的全部原始数据"""
-    try:
-        now = datetime.now()
-        one_week_ago = now - timedelta(days=7)
-        
-        # 设置一个较大的值来获取所有记录
-        max_records = 200000  # 假设一周内的记录不会超过这个数量
-        
-        rows = await run_in_threadpool(fetch_by_time_range, one_week_ago, now, max_records)
-        processed_rows = _process_raw_data(rows)
-        
-        print(f"Debug - 最近一周获取记录数: {len(processed_rows)}")
-        
-        return processed_rows
-    except Exception as e:
-        print(f"Error in weekly_tests endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    # 假设一周内的记录不会超过 200000
+    return await _recent_tests("weekly_tests", "一周", timedelta(days=7), 200000, filters)
 
 
 @app.get("/weekly/summary")
-async def weekly_summary():
+async def weekly_summary(filters: RowFilter = Depends(_row_filter)):
     """最近一周 → 按楼栋统计累计有功功率(kW)。"""
-    try:
-        now = datetime.now()
-        one_week_ago = now - timedelta(days=7)
-        
-        # 设置一个较大的值来获取所有记录
-        max_records = 200000  # 假设一周内的记录不会超过这个数量
-        
-        rows = await run_in_threadpool(fetch_by_time_range, one_week_ago, now, max_records)
-        agg = _aggregate_by_building(rows)
-        
-        print(f"Debug - 最近一周汇总记录数: {len(rows)}")
-        
-        return JSONResponse(agg)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await _recent_summary("weekly_summary", "一周", timedelta(days=7), 200000, filters)
 
 
 @app.get("/monthly/tests", response_model=List[DataRecord])
-async def monthly_tests():
+async def monthly_tests(filters: RowFilter = Depends(_row_filter)):
     """最近一个月的全部原始数据"""
-    try:
-        now = datetime.now()
-        one_month_ago = now - timedelta(days=30)  # 使用30天作为一个月的近似值
-        
-        # 设置一个较大的值来获取所有记录
-        max_records = 500000  # 假设一个月内的记录不会超过这个数量
-        
-        rows = await run_in_threadpool(fetch_by_time_range, one_month_ago, now, max_records)
-        processed_rows = _process_raw_data(rows)
-        
-        print(f"Debug - 最近一个月获取记录数: {len(processed_rows)}")
-        
-        return processed_rows
-    except Exception as e:
-        print(f"Error in monthly_tests endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    # 使用30天作为一个月的近似值，假设记录不会超过 500000
+    return await _recent_tests("monthly_tests", "一个月", timedelta(days=30), 500000, filters)
 
 
 @app.get("/monthly/summary")
-async def monthly_summary():
+async def monthly_summary(filters: RowFilter = Depends(_row_filter)):
     """最近一个月 → 按楼栋统计累计有功功率(kW)。"""
-    try:
-        now = datetime.now()
-        one_month_ago = now - timedelta(days=30)  # 使用30天作为一个月的近似值
-        
-        # 设置一个较大的值来获取所有记录
-        max_records = 500000  # 假设一个月内的记录不会超过这个数量
-        
-        rows = await run_in_threadpool(fetch_by_time_range, one_month_ago, now, max_records)
-        agg = _aggregate_by_building(rows)
-        
-        print(f"Debug - 最近一个月汇总记录数: {len(rows)}")
-        
-        return JSONResponse(agg)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await _recent_summary("monthly_summary", "一个月", timedelta(days=30), 500000, filters)
 
 
 @app.get("/custom/tests", response_model=List[DataRecord])
 async def custom_tests(
     start_date: str = Query(..., description="开始日期（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss）"),
-    end_date: str = Query(..., description="结束日期（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss）")
+    end_date: str = Query(..., description="结束日期（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss）"),
+    filters: RowFilter = Depends(_row_filter)
 ):
-    """自定义时间范围的全部原始数据（最长7天）"""
+    """自定义时间范围的全部原始数据（最长7天）；原始行不进入响应缓存"""
+    start_dt, end_dt = await _validate_date_range(start_date, end_date)
+
     try:
-        start_dt, end_dt = await _validate_date_range(start_date, end_date)
-        
         # 调试信息
         print(f"Debug - 查询时间范围: {start_dt} 到 {end_dt}")
-        
+
         # 设置一个较大的值来获取所有记录
         max_records = 200000  # 假设7天内的记录不会超过这个数量
-        
-        rows = await run_in_threadpool(fetch_by_time_range, start_dt, end_dt, max_records)
-        
+
+        rows = await run_in_threadpool(_fetch_range, start_dt, end_dt, max_records, *filters)
+
         # 调试信息
         if rows:
             print(f"Debug - 查询到数据行数: {len(rows)}")
-            if len(rows) > 0:
-                print(f"Debug - 第一行数据时间: {rows[0].get('timestamp1', 'N/A')}")
-                print(f"Debug - 最后一行数据时间: {rows[-1].get('timestamp1', 'N/A')}")
+            print(f"Debug - 第一行数据时间: {rows[0].get('timestamp1', 'N/A')}")
+            print(f"Debug - 最后一行数据时间: {rows[-1].get('timestamp1', 'N/A')}")
         else:
             print("Debug - 未查询到数据")
-            
-        processed_rows = _process_raw_data(rows)
-        
-        return processed_rows
+
+        return _process_raw_data(rows)
     except Exception as e:
-        if isinstance(e, HTTPException):
-            raise e
         print(f"Error in custom_tests endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _upstream_error(e)
 
 
 @app.get("/custom/summary")
 async def custom_summary(
     start_date: str = Query(..., description="开始日期（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss）"),
-    end_date: str = Query(..., description="结束日期（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss）")
+    end_date: str = Query(..., description="结束日期（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss）"),
+    filters: RowFilter = Depends(_row_filter)
 ):
     """自定义时间范围 → 按楼栋统计累计有功功率(kW)（最长7天）。"""
-    try:
-        start_dt, end_dt = await _validate_date_range(start_date, end_date)
-        
+    start_dt, end_dt = await _validate_date_range(start_date, end_date)
+
+    async def compute():
         # 调试信息
         print(f"Debug - 汇总查询时间范围: {start_dt} 到 {end_dt}")
-        
+
         # 设置一个较大的值来获取所有记录
         max_records = 200000  # 假设7天内的记录不会超过这个数量
-        
-        rows = await run_in_threadpool(fetch_by_time_range, start_dt, end_dt, max_records)
-        
+
+        rows = await run_in_threadpool(_fetch_range, start_dt, end_dt, max_records, *filters)
+
         # 调试信息
         if rows:
             print(f"Debug - 汇总查询到数据行数: {len(rows)}")
         else:
             print("Debug - 汇总未查询到数据")
-            
-        agg = _aggregate_by_building(rows)
-        
-        return JSONResponse(agg)
+
+        return _aggregate_by_building(rows)
+
+    try:
+        agg, age, stale = await _response_cache.get(("custom_summary", start_dt, end_dt, filters), compute)
+        return JSONResponse(agg, headers=cache_headers(age, stale))
     except Exception as e:
-        if isinstance(e, HTTPException):
-            raise e
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _upstream_error(e)
+
+
+async def _compute_daily_stats(filters: RowFilter) -> Dict:
+    """最近10天内每天按楼栋统计的有功功率汇总"""
+    now = datetime.now()
+
+    # 按天统计结果
+    daily_stats = OrderedDict()
+
+    for day_offset in range(10):
+        # 计算每天的开始和结束时间
+        current_day = now - timedelta(days=day_offset)
+
+        # 当天的零点
+        day_start = current_day.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        # 如果是当天，结束时间为当前时间；否则为当天最后一秒
+        if day_offset == 0:
+            day_end = now
+        else:
+            day_end = day_start + timedelta(days=1, seconds=-1)  # 23:59:59
+
+        # 日期格式化为 YYYY-MM-DD 用作 key
+        day_key = day_start.strftime("%Y-%m-%d")
+
+        # 设置一个较大的值来获取所有记录
+        max_records = 50000  # 假设一天内的记录不会超过这个数量
+
+        # 查询该天的数据
+        rows = await run_in_threadpool(_fetch_range, day_start, day_end, max_records, *filters)
+
+        # 计算该天的汇总数据
+        agg = _aggregate_by_building(rows)
+
+        # 添加到结果中
+        daily_stats[day_key] = {
+            "date": day_key,
+            "summary": agg,
+            "record_count": len(rows)
+        }
+
+        print(f"Debug - 日期: {day_key}, 记录数: {len(rows)}")
+
+    return daily_stats
+
+
+async def _daily_stats_view(filters: RowFilter = RowFilter()):
+    return await _response_cache.get(("daily_stats", filters), lambda: _compute_daily_stats(filters))
 
 
 @app.get("/daily-stats/summary")
-async def daily_stats_summary():
+async def daily_stats_summary(filters: RowFilter = Depends(_row_filter)):
     """最近10天内每天按楼栋统计的有功功率汇总"""
     try:
-        now = datetime.now()
-        ten_days_ago = now - timedelta(days=10)
-        
-        # 按天统计结果
-        daily_stats = OrderedDict()
-        
-        for day_offset in range(10):
-            # 计算每天的开始和结束时间
-            current_day = now - timedelta(days=day_offset)
-            
-            # 当天的零点
-            day_start = current_day.replace(hour=0, minute=0, second=0, microsecond=0)
-            
-            # 如果是当天，结束时间为当前时间；否则为当天最后一秒
-            if day_offset == 0:
-                day_end = now
-            else:
-                day_end = day_start + timedelta(days=1, seconds=-1)  # 23:59:59
-            
-            # 日期格式化为 YYYY-MM-DD 用作 key
-            day_key = day_start.strftime("%Y-%m-%d")
-            
-            # 设置一个较大的值来获取所有记录
-            max_records = 50000  # 假设一天内的记录不会超过这个数量
-            
-            # 查询该天的数据
-            rows = await run_in_threadpool(fetch_by_time_range, day_start, day_end, max_records)
-            
-            # 计算该天的汇总数据
-            agg = _aggregate_by_building(rows)
-            
-            # 添加到结果中
-            daily_stats[day_key] = {
-                "date": day_key,
-                "summary": agg,
-                "record_count": len(rows)
-            }
-            
-            print(f"Debug - 日期: {day_key}, 记录数: {len(rows)}")
-        
-        return JSONResponse(daily_stats)
+        daily_stats, age, stale = await _daily_stats_view(filters)
+        return JSONResponse(daily_stats, headers=cache_headers(age, stale))
     except Exception as e:
         print(f"Error in daily_stats_summary endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _upstream_error(e)
+
+
+async def _compute_half_hourly(now: datetime, filters: RowFilter) -> Dict:
+    """从 now 往前推算24小时内每半个小时的功率汇总数据"""
+    # 计算整点或半点时间
+    if now.minute < 30:
+        last_half_hour = now.replace(minute=0, second=0, microsecond=0)
+    else:
+        last_half_hour = now.replace(minute=30, second=0, microsecond=0)
+
+    print(f"Debug - 最近半小时整点: {last_half_hour}")
+
+    # 24小时前的时间（48个半小时）
+    day_ago = last_half_hour - timedelta(days=1)
+
+    result = {}
+    step = timedelta(minutes=30)
+
+    # 一次取回整个窗口，再在内存中按半小时切分（原先每段各查一次，共49次回源）。
+    # 与逐段查询 [start, end] 保持一致：恰好落在边界上的记录同时计入相邻两段。
+    # 上限与原先的逐段查询相同（49 段 × 10000），触顶时最早的时段会不完整，需要提示
+    window_end = last_half_hour + step
+    max_records = 49 * 10000
+    window_rows = await run_in_threadpool(_fetch_range, day_ago, window_end, max_records, *filters)
+    if len(window_rows) >= max_records:
+        print(f"Warning - 半小时汇总窗口记录数达到上限 {max_records}，最早的时段可能不完整")
+    slots: List[List[Dict]] = [[] for _ in range(49)]
+    partial_rows: List[Dict] = []
+    for row in window_rows:
+        t = parse_row_time(row)
+        if t is None or t < day_ago or t > window_end:
+            continue
+        idx, rem = divmod(t - day_ago, step)
+        if idx < len(slots):
+            slots[idx].append(row)
+        if rem == timedelta(0) and idx > 0:
+            slots[idx - 1].append(row)
+        if last_half_hour <= t <= now:
+            partial_rows.append(row)
+
+    # 为每个半小时时间段生成数据
+    current_time = day_ago
+    for rows in slots:
+        # 计算时间段结束时间
+        end_time = current_time + step
+
+        # 汇总该时间段的数据
+        agg = _aggregate_by_building(rows)
+
+        # 使用时间段的结束时间作为键
+        time_key = end_time.strftime("%Y-%m-%d %H:%M:%S")
+
+        # 存储结果
+        result[time_key] = {
+            "end_time": time_key,
+            "summary": agg
+        }
+
+        # 移动到下一个半小时时间段
+        current_time = end_time
+
+    # 添加当前时间的数据
+    if now > last_half_hour:
+        agg = _aggregate_by_building(partial_rows)
+        current_time_key = now.strftime("%Y-%m-%d %H:%M:%S")
+        result[current_time_key] = {
+            "end_time": current_time_key,
+            "summary": agg
+        }
+
+    print(f"Debug - 总共生成时间段数: {len(result)}")
+
+    return result
+
+
+async def _half_hourly_view(filters: RowFilter = RowFilter()):
+    return await _response_cache.get(
+        ("half_hourly", filters), lambda: _compute_half_hourly(datetime.now(), filters)
+    )
 
 
 @app.get("/half-hourly/summary")
-async def half_hourly_summary():
+async def half_hourly_summary(filters: RowFilter = Depends(_row_filter)):
     """获取当前时间往前推算24小时内每半个小时的功率汇总数据"""
     try:
-        # 获取当前时间
-        now = datetime.now()
-        
-        # 计算整点或半点时间
-        if now.minute < 30:
-            last_half_hour = now.replace(minute=0, second=0, microsecond=0)
-        else:
-            last_half_hour = now.replace(minute=30, second=0, microsecond=0)
-            
-        # 24小时前的时间（48个半小时）
-        day_ago = last_half_hour - timedelta(days=1)
-        
-        result = {}
-        
-        # 为每个半小时时间段生成数据
-        current_time = day_ago
-        while current_time <= last_half_hour:
-            # 计算时间段结束时间
-            end_time = current_time + timedelta(minutes=30)
-            
-            # 获取该时间段的数据
-            rows = await run_in_threadpool(fetch_by_time_range, current_time, end_time, 10000)
-            
-            # 汇总该时间段的数据
-            agg = _aggregate_by_building(rows)
-            
-            # 使用时间段的结束时间作为键
-            time_key = end_time.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # 存储结果
-            result[time_key] = {
-                "end_time": time_key,
-                "summary": agg
-            }
-            
-            # 移动到下一个半小时时间段
-            current_time = end_time
-        
-        # 添加当前时间的数据
-        if now > last_half_hour:
-            rows = await run_in_threadpool(fetch_by_time_range, last_half_hour, now, 10000)
-            agg = _aggregate_by_building(rows)
-            current_time_key = now.strftime("%Y-%m-%d %H:%M:%S")
-            result[current_time_key] = {
-                "end_time": current_time_key,
-                "summary": agg
-            }
-        
-        return JSONResponse(result)
+        result, age, stale = await _half_hourly_view(filters)
+        return JSONResponse(result, headers=cache_headers(age, stale))
     except Exception as e:
         print(f"Error in half_hourly_summary endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _upstream_error(e)
 
 
 @app.get("/test/half-hourly/summary")
 async def test_half_hourly_summary(
-    test_time: str = Query(..., description="测试时间（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss 或 YYYY-MM-DD hh:mm:ss）")
+    test_time: str = Query(..., description="测试时间（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss 或 YYYY-MM-DD hh:mm:ss）"),
+    filters: RowFilter = Depends(_row_filter)
 ):
     """测试API：根据指定时间往前推算24小时内每半个小时的功率汇总数据"""
     try:
@@ -515,83 +602,160 @@ async def test_half_hourly_summary(
             test_dt = datetime.fromisoformat(f"{test_time}T00:00:00")
         else:
             test_dt = datetime.fromisoformat(test_time.replace(" ", "T") if " " in test_time else test_time)
-        
-        print(f"Debug - 测试时间: {test_dt}")
-        
-        # 计算整点或半点时间
-        if test_dt.minute < 30:
-            last_half_hour = test_dt.replace(minute=0, second=0, microsecond=0)
-        else:
-            last_half_hour = test_dt.replace(minute=30, second=0, microsecond=0)
-            
-        print(f"Debug - 最近半小时整点: {last_half_hour}")
-        
-        # 24小时前的时间（48个半小时）
-        day_ago = last_half_hour - timedelta(days=1)
-        
-        print(f"Debug - 24小时前时间: {day_ago}")
-        
-        result = {}
-        
-        # 为每个半小时时间段生成数据
-        current_time = day_ago
-        while current_time <= last_half_hour:
-            # 计算时间段结束时间
-            end_time = current_time + timedelta(minutes=30)
-            
-            print(f"Debug - 正在查询时间范围: {current_time} 至 {end_time}")
-            
-            # 获取该时间段的数据
-            rows = await run_in_threadpool(fetch_by_time_range, current_time, end_time, 10000)
-            
-            print(f"Debug - 该时间段获取记录数: {len(rows)}")
-            
-            # 汇总该时间段的数据
-            agg = _aggregate_by_building(rows)
-            
-            print(f"Debug - 该时间段数据汇总: {agg}")
-            
-            # 使用时间段的结束时间作为键
-            time_key = end_time.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # 存储结果
-            result[time_key] = {
-                "end_time": time_key,
-                "summary": agg
-            }
-            
-            # 移动到下一个半小时时间段
-            current_time = end_time
-        
-        # 添加当前时间的数据
-        if test_dt > last_half_hour:
-            print(f"Debug - 正在查询最后时间段: {last_half_hour} 至 {test_dt}")
-            
-            rows = await run_in_threadpool(fetch_by_time_range, last_half_hour, test_dt, 10000)
-            
-            print(f"Debug - 最后时间段获取记录数: {len(rows)}")
-            
-            agg = _aggregate_by_building(rows)
-            
-            print(f"Debug - 最后时间段数据汇总: {agg}")
-            
-            current_time_key = test_dt.strftime("%Y-%m-%d %H:%M:%S")
-            result[current_time_key] = {
-                "end_time": current_time_key,
-                "summary": agg
-            }
-        
-        print(f"Debug - 总共生成时间段数: {len(result)}")
-        
-        return JSONResponse(result)
     except ValueError:
         raise HTTPException(
-            status_code=400, 
+            status_code=400,
             detail="日期格式无效，请使用ISO格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss 或 YYYY-MM-DD hh:mm:ss"
         )
+
+    print(f"Debug - 测试时间: {test_dt}")
+
+    try:
+        result, age, stale = await _response_cache.get(
+            ("test_half_hourly", test_dt, filters), lambda: _compute_half_hourly(test_dt, filters)
+        )
+        return JSONResponse(result, headers=cache_headers(age, stale))
     except Exception as e:
         print(f"Error in test_half_hourly_summary endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _upstream_error(e)
+
+
+@app.get("/stats")
+async def stats(
+    start: str = Query(..., description="开始日期（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss）"),
+    end: str = Query(..., description="结束日期（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss）"),
+    quantiles: str = Query(config.STATS_DEFAULT_QUANTILES, description="逗号分隔的分位数，如 0.5,0.95,0.99"),
+    filters: RowFilter = Depends(_row_filter)
+):
+    """自定义时间范围 → 按楼栋统计功率/电压/电流的 count/sum/avg/min/max 及分位数（最长31天）"""
+    start_dt, end_dt = await _validate_date_range(start, end, config.STATS_MAX_DAYS)
+    try:
+        qs = parse_quantiles(quantiles)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="quantiles 格式无效，请使用 0~1 之间的逗号分隔小数")
+
+    async def compute():
+        # 共享缓存的 high 水位之后的数据可能还没拉到，对应的桶不能关闭
+        settled_until = _shared_cache.watermarks()[1] if config.SHARED_CACHE_ENABLED else None
+        result = await run_in_threadpool(
+            _bucket_store.query, start_dt, end_dt, qs, _fetch_range,
+            buildings=filters.buildings, floors=filters.floors, settled_until=settled_until
+        )
+
+        print(f"Debug - 统计桶数: {result['bucket_count']}, 回源记录数: {result['fetched_rows']}")
+
+        return result
+
+    try:
+        result, age, stale = await _response_cache.get(("stats", start_dt, end_dt, tuple(qs), filters), compute)
+        return JSONResponse(result, headers=cache_headers(age, stale))
+    except Exception as e:
+        print(f"Error in stats endpoint: {str(e)}")
+        raise _upstream_error(e)
+
+
+@app.get("/consumption")
+async def consumption(
+    start: str = Query(..., description="开始日期（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss）"),
+    end: str = Query(..., description="结束日期（格式：YYYY-MM-DD 或 YYYY-MM-DDThh:mm:ss）"),
+    bucket: str = Query("day", pattern="^(none|hour|day|month)$", description="分桶：none/hour/day/month"),
+    filters: RowFilter = Depends(_row_filter)
+):
+    """
+    自定义时间范围 → 按楼栋/楼层/相统计用电量(kWh)，只读取每块电表每个桶的首末读数
+    （最长366天；bucket=hour 时最长31天）
+    """
+    max_days = config.CONSUMPTION_HOURLY_MAX_DAYS if bucket == "hour" else config.CONSUMPTION_MAX_DAYS
+    start_dt, end_dt = await _validate_date_range(start, end, max_days)
+
+    async def compute():
+        rows = await run_in_threadpool(
+            _fetch_boundaries, start_dt, end_dt, BUCKET_FORMATS[bucket], *filters
+        )
+        result = compute_consumption(rows, bucket)
+
+        print(f"Debug - 用电量首末读数行数: {len(rows)}, 电表数: {result['meters']}")
+
+        result.update({
+            "start": start_dt.strftime("%Y-%m-%d %H:%M:%S"),
+            "end": end_dt.strftime("%Y-%m-%d %H:%M:%S"),
+            "bucket": bucket,
+            "unit": "kWh",
+            "boundary_rows": len(rows),
+        })
+        return result
+
+    try:
+        result, age, stale = await _response_cache.get(("consumption", start_dt, end_dt, bucket, filters), compute)
+        return JSONResponse(result, headers=cache_headers(age, stale))
+    except Exception as e:
+        print(f"Error in consumption endpoint: {str(e)}")
+        raise _upstream_error(e)
+
+
+@app.get("/anomalies")
+async def anomalies(
+    limit: int = Query(50, ge=1, le=config.ANOMALY_MAX_EVENTS, description="返回事件数"),
+    refresh: bool = Query(False, description="返回前先回源拉取最近 MAX_LIMIT 行喂给检测器"),
+    filters: RowFilter = Depends(_row_filter)
+):
+    """流式异常检测最近的事件（新 → 旧）"""
+    try:
+        if refresh:
+            await run_in_threadpool(_fetch_latest, config.MAX_LIMIT, *filters)
+
+        result = _detector.status()
+        result["events"] = _detector.events(limit, *filters)
+        return JSONResponse(result)
+    except Exception as e:
+        print(f"Error in anomalies endpoint: {str(e)}")
+        raise _upstream_error(e)
+
+
+def _upstream_warmup() -> bool:
+    """本进程是否直接回源预热：未启用共享缓存，或本进程是共享缓存的 leader"""
+    return not config.SHARED_CACHE_ENABLED or _shared_cache.is_leader
+
+
+async def _warm_login():
+    if not _upstream_warmup():
+        return False    # 非 leader 只读共享缓存，不需要上游会话
+    await run_in_threadpool(warm_up_sessions)
+
+
+def _warm_view(view, window: timedelta):
+    """预计算视图；非 leader 只在共享缓存已覆盖 window 时预计算，避免每个 worker 各自回源"""
+    async def step():
+        if not _upstream_warmup() and not _shared_cache.covers(datetime.now() - window):
+            return False
+        await view()
+    return step
+
+
+def _warmup_steps():
+    """
+    预热步骤：解析库 →（等待共享缓存首轮拉取）→ 上游登录 → 最常用的两个视图。
+    多 worker 时只有 leader 登录并回源预计算，其余 worker 的上游负载为零
+    """
+    steps = [("parser", lambda: run_in_threadpool(preload_parser))]
+    if config.SHARED_CACHE_ENABLED:
+        # 首轮拉取完成时 leader 已选出，之后的步骤据此决定是否回源
+        steps.append(("shared_cache", lambda: run_in_threadpool(
+            _shared_cache.wait_ready, config.WARMUP_CACHE_WAIT_SECONDS)))
+    steps += [
+        ("upstream_login", _warm_login),
+        ("half_hourly_summary", _warm_view(_half_hourly_view, timedelta(hours=24, minutes=30))),
+        ("daily_stats_summary", _warm_view(_daily_stats_view, timedelta(days=10))),
+    ]
+    return steps
+
+
+@app.get("/ready")
+async def ready():
+    """就绪探针：预热完成前返回 503，响应体为各预热步骤的进度及上游熔断器状态"""
+    status = _warmup.status()
+    status["upstream"] = breaker_state()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 
 @app.get("/", include_in_schema=False)
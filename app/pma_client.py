@@ -4,21 +4,37 @@
 app/pma_client.py  · 兼容你已验证可行的抓取方式
 """
 
-import re, requests
-from typing import List, Dict
+import re, requests, threading
+from typing import List, Dict, Optional, Sequence, Tuple
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 from . import config
+from .resilience import CircuitBreaker
+from .utils import UNKNOWN_BUILDING
+
+# 只有网络层异常（超时、连接失败、HTTP 5xx 等）计为上游故障
+_breaker = CircuitBreaker(failure_types=(requests.RequestException,))
+
+# 已登录的 (Session, token) 池，避免每次查询都重新登录
+_sessions: List[Tuple[requests.Session, str]] = []
+_sessions_lock = threading.Lock()
+
+def _soup(html: str):
+    return BeautifulSoup(html, "lxml")
+
+def preload_parser():
+    """提前完成一次 lxml 解析（初始化解析器），供启动预热调用"""
+    _soup("<html></html>")
 
 def _get_token(html: str) -> str:
-    soup = BeautifulSoup(html, "lxml")
+    soup = _soup(html)
     inp  = soup.find("input", {"name": "token"})
     if not inp or not inp.get("value"):
         raise RuntimeError("❌ 无法找到 token，检查 phpMyAdmin 版本/路径")
     return inp["value"]
 
 def _parse_table(html: str) -> List[Dict]:
-    soup  = BeautifulSoup(html, "lxml")
+    soup  = _soup(html)
 
     # 若 SQL 报错，phpMyAdmin 会在 div.alert-danger 中显示
     err = soup.find("div", class_=re.compile(r"alert.*danger"))
@@ -42,10 +58,7 @@ def _parse_table(html: str) -> List[Dict]:
             records.append(dict(zip(header, cells)))
     return records
 
-def fetch_latest(limit: int = config.DEFAULT_LIMIT) -> List[Dict]:
-    sql = (f"SELECT * FROM {config.TABLE_NAME} "
-           f"ORDER BY {config.ORDER_BY_COLUMN} DESC LIMIT {limit};")
-
+def _login() -> Tuple[requests.Session, str]:
     s = requests.Session()
     s.headers.update({
         "User-Agent":
@@ -68,8 +81,22 @@ def fetch_latest(limit: int = config.DEFAULT_LIMIT) -> List[Dict]:
     if "phpMyAdmin" not in r.text:
         raise RuntimeError("❌ 登录失败，请检查用户名/密码")
 
-    token = _get_token(r.text)
+    return s, _get_token(r.text)
 
+def _acquire_session() -> Tuple[requests.Session, str]:
+    with _sessions_lock:
+        if _sessions:
+            return _sessions.pop()
+    return _login()
+
+def _release_session(session: Tuple[requests.Session, str]):
+    with _sessions_lock:
+        if len(_sessions) < config.PMA_SESSION_POOL_SIZE:
+            _sessions.append(session)
+            return
+    session[0].close()
+
+def _post_sql(s: requests.Session, token: str, sql: str) -> requests.Response:
     # ② 执行 SQL
     r = s.post(f"{config.PMA_BASE}/sql.php", data={
         "server": 1,
@@ -80,10 +107,76 @@ def fetch_latest(limit: int = config.DEFAULT_LIMIT) -> List[Dict]:
         "pos": 0,
     }, timeout=config.TIMEOUT, verify=config.VERIFY_SSL)
     r.raise_for_status()
+    return r
+
+def _query(sql: str) -> List[Dict]:
+    s, token = _acquire_session()
+    try:
+        r = _post_sql(s, token, sql)
+        if 'name="pma_username"' in r.text:
+            # 会话已过期，phpMyAdmin 返回了登录页：重新登录后重试一次
+            s.close()
+            s, token = _login()
+            r = _post_sql(s, token, sql)
+        rows = _parse_table(r.text)
+    except Exception:
+        s.close()
+        raise
+    _release_session((s, token))
+    return rows
+
+def warm_up_sessions():
+    """启动预热：提前登录，填满会话池"""
+    with _sessions_lock:
+        missing = config.PMA_SESSION_POOL_SIZE - len(_sessions)
+    for _ in range(missing):
+        _release_session(_breaker.call(_login))
+
+def run_sql(sql: str) -> List[Dict]:
+    """
+    经熔断器执行一条 SQL；熔断期间直接抛出 CircuitOpenError，不再等待超时
+    """
+    return _breaker.call(_query, sql)
 
-    return _parse_table(r.text)
+def breaker_state() -> str:
+    """上游熔断器状态（closed / open / half_open），供 /ready 展示"""
+    return _breaker.state
 
-def fetch_by_time_range(start_time: datetime, end_time: datetime, limit: int = 1000000) -> List[Dict]:
+def sql_literal(value: str) -> str:
+    """把任意字符串转成安全的 MySQL 字符串字面量（含两侧引号）"""
+    escaped = (str(value).replace("\\", "\\\\")
+                         .replace("'", "''")
+                         .replace("\0", "\\0"))
+    return f"'{escaped}'"
+
+def filter_clause(buildings: Optional[Sequence[str]] = None,
+                  floors: Optional[Sequence[int]] = None) -> str:
+    """
+    Building/Floor 多值过滤条件，形如 " AND Building IN ('A','B') AND Floor IN (1,2)"；
+    无过滤时返回空串。与内存汇总一致，"UNKNOWN" 同时匹配楼栋为空的行
+    """
+    clause = ""
+    if buildings:
+        cond = "Building IN (" + ",".join(sql_literal(b) for b in buildings) + ")"
+        if UNKNOWN_BUILDING in buildings:
+            cond = f"({cond} OR Building IS NULL OR Building = '')"
+        clause += " AND " + cond
+    if floors:
+        clause += " AND Floor IN (" + ",".join(str(int(f)) for f in floors) + ")"
+    return clause
+
+def fetch_latest(limit: int = config.DEFAULT_LIMIT,
+                 buildings: Optional[Sequence[str]] = None,
+                 floors: Optional[Sequence[int]] = None) -> List[Dict]:
+    sql = (f"SELECT * FROM {config.TABLE_NAME} "
+           f"WHERE 1=1{filter_clause(buildings, floors)} "
+           f"ORDER BY {config.ORDER_BY_COLUMN} DESC LIMIT {limit};")
+
+    return run_sql(sql)
+
+def fetch_by_time_range(start_time: datetime, end_time: datetime, limit: int = 1000000,
+                        buildings: Optional[Sequence[str]] = None,
+                        floors: Optional[Sequence[int]] = None) -> List[Dict]:
     """
     根据时间范围获取数据
     
@@ -91,6 +184,8 @@ def fetch_by_time_range(start_time: datetime, end_time: datetime, limit: int = 1
         start_time: 开始时间
         end_time: 结束时间
         limit: 最大返回行数（默认设置为一个非常大的数，以确保获取所有记录）
+        buildings: 只取这些楼栋（None 表示不过滤）
+        floors: 只取这些楼层（None 表示不过滤）
     
     Returns:
         符合时间范围的数据列表
@@ -101,42 +196,42 @@ def fetch_by_time_range(start_time: datetime, end_time: datetime, limit: int = 1
     
     # 优化 SQL 查询，确保获取从大于等于开始日期到小于等于结束日期的数据
     sql = (f"SELECT * FROM {config.TABLE_NAME} "
-           f"WHERE {config.ORDER_BY_COLUMN} >= '{start_time_str}' AND {config.ORDER_BY_COLUMN} <= '{end_time_str}' "
+           f"WHERE {config.ORDER_BY_COLUMN} >= '{start_time_str}' AND {config.ORDER_BY_COLUMN} <= '{end_time_str}'"
+           f"{filter_clause(buildings, floors)} "
            f"ORDER BY {config.ORDER_BY_COLUMN} DESC LIMIT {limit};")
 
-    s = requests.Session()
-    s.headers.update({
-        "User-Agent":
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0"
-    })
-
-    # ① 登录
-    login_url = f"{config.PMA_BASE}/index.php"
-    r = s.get(login_url, timeout=config.TIMEOUT, verify=config.VERIFY_SSL)
-    token = _get_token(r.text)
+    return run_sql(sql)
 
-    r = s.post(login_url, data={
-        "pma_username": config.PMA_USERNAME,
-        "pma_password": config.PMA_PASSWORD,
-        "server": 1,
-        "target": "index.php",
-        "token": token,
-    }, timeout=config.TIMEOUT, verify=config.VERIFY_SSL)
-    if "phpMyAdmin" not in r.text:
-        raise RuntimeError("❌ 登录失败，请检查用户名/密码")
+def fetch_boundary_rows(start_time: datetime, end_time: datetime, bucket_format: str,
+                        buildings: Optional[Sequence[str]] = None,
+                        floors: Optional[Sequence[int]] = None) -> List[Dict]:
+    """
+    每块电表（Building, Floor）在每个时间桶内的首、末两条有效记录（三相电能均大于 0）
 
-    token = _get_token(r.text)
+    Args:
+        start_time: 开始时间
+        end_time: 结束时间
+        bucket_format: 分桶格式（DATE_FORMAT 语法，如 "%Y-%m-%d"；空串表示整个范围一个桶）
+        buildings: 只取这些楼栋（None 表示不过滤）
+        floors: 只取这些楼层（None 表示不过滤）
 
-    # ② 执行 SQL
-    r = s.post(f"{config.PMA_BASE}/sql.php", data={
-        "server": 1,
-        "db": config.DATABASE_NAME,
-        "table": config.TABLE_NAME,
-        "token": token,
-        "sql_query": sql,
-        "pos": 0,
-    }, timeout=config.TIMEOUT, verify=config.VERIFY_SSL)
-    r.raise_for_status()
+    Returns:
+        首末记录列表（按时间升序），只需一次查询，行数与 电表数 × 桶数 成正比
+    """
+    ts = config.ORDER_BY_COLUMN
+    start_time_str = start_time.strftime("%Y-%m-%d %H:%M:%S")
+    end_time_str = end_time.strftime("%Y-%m-%d %H:%M:%S")
 
-    return _parse_table(r.text) 
\ No newline at end of file
+    # 子查询按电表、按桶找出有效读数（三相电能均大于 0）的 MIN/MAX 时间戳，再回表取这两条完整记录
+    sql = (f"SELECT d.* FROM {config.TABLE_NAME} d "
+           f"JOIN (SELECT Building, Floor, MIN({ts}) AS first_ts, MAX({ts}) AS last_ts "
+           f"FROM {config.TABLE_NAME} "
+           f"WHERE {ts} >= '{start_time_str}' AND {ts} <= '{end_time_str}' "
+           f"AND energy1 > 0 AND energy2 > 0 AND energy3 > 0"
+           f"{filter_clause(buildings, floors)} "
+           f"GROUP BY Building, Floor, DATE_FORMAT({ts}, {sql_literal(bucket_format)})) b "
+           f"ON d.Building <=> b.Building AND d.Floor <=> b.Floor "
+           f"AND (d.{ts} = b.first_ts OR d.{ts} = b.last_ts) "
+           f"ORDER BY d.{ts} LIMIT 1000000;")
+
+    return run_sql(sql)
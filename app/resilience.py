@@ -0,0 +1,166 @@
+"""
+app/resilience.py  · 上游故障时的保护：熔断器 + stale-while-revalidate 响应缓存
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Type
+
+from . import config
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断期间拒绝回源"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"❌ 上游不可用，已熔断，{retry_after:.0f} 秒后重试")
+
+
+class CircuitBreaker:
+    """
+    连续失败 failure_threshold 次后熔断 cooldown 秒；冷却结束后只放行一个试探请求，
+    成功则恢复，失败则重新熔断。只有 failure_types 中的异常计为上游故障。
+    """
+
+    def __init__(self,
+                 failure_threshold: int = config.BREAKER_FAILURE_THRESHOLD,
+                 cooldown: float = config.BREAKER_COOLDOWN,
+                 failure_types: Tuple[Type[BaseException], ...] = (Exception,)):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failure_types = failure_types
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return "open"
+            return "half_open"
+
+    def _before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(remaining)
+            if self._probing:
+                raise CircuitOpenError(0)
+            self._probing = True
+
+    def _on_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def _on_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def call(self, func: Callable, *args, **kwargs):
+        self._before_call()
+        try:
+            result = func(*args, **kwargs)
+        except self.failure_types:
+            self._on_failure()
+            raise
+        except BaseException:
+            # 非上游故障（如 SQL 错误）：不计失败，但要结束试探
+            with self._lock:
+                self._probing = False
+            raise
+        self._on_success()
+        return result
+
+
+class SWRCache:
+    """
+    响应级 stale-while-revalidate 缓存（在事件循环中使用）。
+    只缓存汇总类的小结果；原始行列表（/…/tests）体积可达数十万行，不应放进来。
+
+    * 新鲜（< ttl）：直接返回
+    * 过期但未超过 max_stale：立即返回旧值并标记 stale，后台只跑一个刷新任务
+    * 无可用旧值：同步计算，同一 key 的并发请求共享一次计算
+    """
+
+    def __init__(self,
+                 ttl: float = config.RESPONSE_TTL_SECONDS,
+                 max_stale: float = config.RESPONSE_MAX_STALE_SECONDS,
+                 max_entries: int = config.RESPONSE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    def _store(self, key: Hashable, value: Any):
+        now = time.monotonic()
+        self._entries[key] = (now, value)
+        self._entries.move_to_end(key)
+        # 条目按写入时间排列：先清掉已超过 max_stale、不会再返回的旧条目，再按条目数截断
+        while self._entries:
+            stored_at, _ = next(iter(self._entries.values()))
+            if now - stored_at < self.ttl + self.max_stale:
+                break
+            self._entries.popitem(last=False)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]):
+        try:
+            value = await compute()
+            self._store(key, value)
+            return value
+        finally:
+            self._pending.pop(key, None)
+
+    def _start(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._compute(key, compute))
+            self._pending[key] = task
+        return task
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error in background refresh: {str(task.exception())}")
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, float, bool]:
+        """返回 (value, age 秒, 是否陈旧)"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            age = time.monotonic() - stored_at
+            if age < self.ttl:
+                return value, age, False
+            if age < self.ttl + self.max_stale:
+                if key not in self._pending:
+                    self._start(key, compute).add_done_callback(self._log_refresh_error)
+                return value, age, True
+            del self._entries[key]
+
+        # shield：调用方断开连接时不取消共享的计算
+        value = await asyncio.shield(self._start(key, compute))
+        return value, 0.0, False
+
+
+def cache_headers(age: float, stale: bool) -> Dict[str, str]:
+    """响应头：X-Cache 标明新鲜/陈旧，Age 为缓存结果的秒数"""
+    headers = {"X-Cache": "stale" if stale else "fresh", "Age": str(int(age))}
+    if stale:
+        headers["Warning"] = '110 - "Response is Stale"'
+    return headers
@@ -0,0 +1,349 @@
+"""
+app/shared_cache.py  · 多 worker 共享的原始行缓存
+
+`uvicorn --workers N` 下每个进程都会启动一个后台线程：
+  * 通过文件锁选举出唯一的 leader，只有 leader 登录 phpMyAdmin 增量拉取新行、
+    回填历史并清理过期数据，写入 SQLite（WAL 模式）；
+  * 所有 worker 直接读同一个 SQLite 文件，WAL 下读者不阻塞写者也不互相阻塞；
+  * meta 表中的 low/high 水位标记缓存完整覆盖的时间范围，查询范围不在水位内就返回 None，
+    由调用方回源。leader 挂掉后锁随进程释放，其它 worker 会接管。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from . import config
+from .utils import UNKNOWN_BUILDING, parse_row_time
+
+try:
+    import fcntl
+except ImportError:          # Windows
+    fcntl = None
+    import msvcrt
+
+_TIME_FMT = "%Y-%m-%d %H:%M:%S"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    id       INTEGER PRIMARY KEY,
+    ts       TEXT NOT NULL,
+    building TEXT,
+    floor    INTEGER,
+    data     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rows_ts ON rows (ts);
+CREATE INDEX IF NOT EXISTS idx_rows_building_floor_ts ON rows (building, floor, ts);
+CREATE INDEX IF NOT EXISTS idx_rows_building_ts ON rows (building, ts);
+CREATE INDEX IF NOT EXISTS idx_rows_floor_ts ON rows (floor, ts);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+# 有效电能读数：三相累计电能均大于 0（data 中为字符串，需转成数值再比较）
+_VALID_ENERGY = "".join(
+    f" AND CAST(json_extract(data, '$.energy{phase}') AS REAL) > 0" for phase in "123"
+)
+
+
+def _fmt(t: datetime) -> str:
+    return t.strftime(_TIME_FMT)
+
+
+def _filter_sql(buildings: Optional[Sequence[str]],
+                floors: Optional[Sequence[int]]) -> Tuple[str, List]:
+    """
+    Building/Floor 过滤条件与参数，按给出的条件命中 (building, floor, ts) / (building, ts) /
+    (floor, ts) 索引。与内存汇总一致，"UNKNOWN" 同时匹配楼栋为空的行
+    """
+    clause, params = "", []
+    if buildings:
+        cond = "building IN (" + ",".join("?" * len(buildings)) + ")"
+        if UNKNOWN_BUILDING in buildings:
+            cond = f"({cond} OR building IS NULL OR building = '')"
+        clause += " AND " + cond
+        params += list(buildings)
+    if floors:
+        clause += " AND floor IN (" + ",".join("?" * len(floors)) + ")"
+        params += [int(f) for f in floors]
+    return clause, params
+
+
+class _LeaderLock:
+    """非阻塞的进程间文件锁，进程退出时由操作系统自动释放"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class SharedCache:
+    """
+    fetch(start, end) 需返回 [start, end] 内的原始行（与 pma_client.fetch_by_time_range 一致），
+    只会在 leader 进程中被调用。
+    """
+
+    def __init__(self, path: str = config.SHARED_CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._lock = _LeaderLock(path + ".lock")
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._fetch: Optional[Callable] = None
+        self._on_rows: Optional[Callable] = None
+        self._cursor: Optional[str] = None     # 本进程已交给 on_rows 的最大时间戳
+
+    # ---- 连接与元数据 ----
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _set_meta(self, conn: sqlite3.Connection, **values: str):
+        conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            list(values.items()),
+        )
+
+    def watermarks(self):
+        """(low, high)：缓存完整覆盖 [low, high]，未初始化时为 (None, None)"""
+        meta = dict(self._conn().execute("SELECT key, value FROM meta WHERE key IN ('low', 'high')"))
+        low, high = meta.get("low"), meta.get("high")
+        if low is None or high is None:
+            return None, None
+        return datetime.strptime(low, _TIME_FMT), datetime.strptime(high, _TIME_FMT)
+
+    def wait_ready(self, timeout: float) -> bool:
+        """阻塞等待缓存完成首轮拉取（有水位），超时返回 False"""
+        deadline = time.monotonic() + timeout
+        while self.watermarks()[1] is None:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.5)
+        return True
+
+    def _is_fresh(self, high: datetime) -> bool:
+        return datetime.now() - high <= timedelta(seconds=config.SHARED_CACHE_MAX_LAG_SECONDS)
+
+    def covers(self, start: datetime) -> bool:
+        """缓存是否完整覆盖 [start, 现在]（即涉及"现在"的查询可以不回源）"""
+        low, high = self.watermarks()
+        return low is not None and low <= start and self._is_fresh(high)
+
+    @property
+    def is_leader(self) -> bool:
+        """本进程是否持有 leader 锁（负责回源）"""
+        return self._lock.held
+
+    # ---- 读 ----
+
+    def read_range(self, start: datetime, end: datetime, limit: int = 1000000,
+                   buildings: Optional[Sequence[str]] = None,
+                   floors: Optional[Sequence[int]] = None) -> Optional[List[Dict]]:
+        """缓存覆盖 [start, end] 时返回其中（可按楼栋/楼层过滤）的行，按时间倒序；否则返回 None"""
+        low, high = self.watermarks()
+        if low is None or start < low:
+            return None
+        if end > high and not self._is_fresh(high):
+            return None
+        clause, params = _filter_sql(buildings, floors)
+        cur = self._conn().execute(
+            f"SELECT data FROM rows WHERE ts >= ? AND ts <= ?{clause} ORDER BY ts DESC LIMIT ?",
+            [_fmt(start), _fmt(end)] + params + [limit],
+        )
+        return [json.loads(r[0]) for r in cur]
+
+    def read_latest(self, n: int,
+                    buildings: Optional[Sequence[str]] = None,
+                    floors: Optional[Sequence[int]] = None) -> Optional[List[Dict]]:
+        """水位足够新时返回最近 n 行（可按楼栋/楼层过滤），否则返回 None"""
+        low, high = self.watermarks()
+        if high is None or not self._is_fresh(high):
+            return None
+        clause, params = _filter_sql(buildings, floors)
+        cur = self._conn().execute(
+            f"SELECT data FROM rows WHERE 1=1{clause} ORDER BY ts DESC LIMIT ?",
+            params + [n],
+        )
+        return [json.loads(r[0]) for r in cur]
+
+    def read_boundaries(self, start: datetime, end: datetime, bucket_format: str,
+                        buildings: Optional[Sequence[str]] = None,
+                        floors: Optional[Sequence[int]] = None) -> Optional[List[Dict]]:
+        """
+        缓存覆盖 [start, end] 时返回每块电表在每个桶（strftime 格式）内的首末两条有效记录
+        （三相电能均大于 0，与 pma_client.fetch_boundary_rows 一致），按时间升序；否则返回 None
+        """
+        low, high = self.watermarks()
+        if low is None or start < low:
+            return None
+        if end > high and not self._is_fresh(high):
+            return None
+        clause, params = _filter_sql(buildings, floors)
+        cur = self._conn().execute(
+            "SELECT r.data FROM rows r JOIN ("
+            "  SELECT building, floor, MIN(ts) AS first_ts, MAX(ts) AS last_ts FROM rows"
+            f" WHERE ts >= ? AND ts <= ?{_VALID_ENERGY}{clause}"
+            "  GROUP BY building, floor, strftime(?, ts)"
+            ") b ON r.building IS b.building AND r.floor IS b.floor"
+            " AND r.ts IN (b.first_ts, b.last_ts) ORDER BY r.ts",
+            [_fmt(start), _fmt(end)] + params + [bucket_format],
+        )
+        return [json.loads(r[0]) for r in cur]
+
+    # ---- 写（仅 leader） ----
+
+    def _ingest(self, rows: List[Dict], **meta: str):
+        records = []
+        for row in rows:
+            t = parse_row_time(row)
+            try:
+                row_id = int(row.get("id"))
+            except (ValueError, TypeError):
+                continue
+            if t is None:
+                continue
+            try:
+                floor = int(row.get("Floor"))
+            except (ValueError, TypeError):
+                floor = None
+            records.append((row_id, _fmt(t), row.get("Building"), floor,
+                            json.dumps(row, ensure_ascii=False)))
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO rows (id, ts, building, floor, data) VALUES (?, ?, ?, ?, ?)",
+                records,
+            )
+            self._set_meta(conn, **meta)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def poll_once(self):
+        """leader 的一轮工作：增量拉取新行 → 回填一段历史 → 清理过期数据"""
+        now = datetime.now().replace(microsecond=0)
+        target_low = now - timedelta(days=config.SHARED_CACHE_RETENTION_DAYS)
+        chunk = timedelta(hours=config.SHARED_CACHE_BACKFILL_HOURS)
+        low, high = self.watermarks()
+
+        if high is None:
+            # 首次运行：先拉最近一段（覆盖预热的视图），让涉及"现在"的查询尽快命中
+            low = max(now - timedelta(hours=config.SHARED_CACHE_INITIAL_HOURS), target_low)
+            self._ingest(self._fetch(low, now), low=_fmt(low), high=_fmt(now))
+            return
+
+        since = max(high - timedelta(seconds=config.SHARED_CACHE_OVERLAP_SECONDS), low)
+        self._ingest(self._fetch(since, now), high=_fmt(now))
+
+        if low > target_low:
+            older = max(low - chunk, target_low)
+            self._ingest(self._fetch(older, low), low=_fmt(older))
+        elif low < target_low:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM rows WHERE ts < ?", (_fmt(target_low),))
+            self._set_meta(conn, low=_fmt(target_low))
+            conn.execute("COMMIT")
+
+    # ---- 跟读：把其它进程写入的新行交给本进程的 on_rows ----
+
+    def _tail(self):
+        if self._on_rows is None:
+            return
+        if self._cursor is None:
+            low, high = self.watermarks()
+            if high is None:
+                return
+            self._cursor = _fmt(max(low, high - timedelta(hours=1)))
+        cur = self._conn().execute(
+            "SELECT ts, data FROM rows WHERE ts > ? ORDER BY ts", (self._cursor,)
+        )
+        rows = []
+        for ts, data in cur:
+            rows.append(json.loads(data))
+            self._cursor = ts
+        if rows:
+            self._on_rows(rows)
+
+    # ---- 后台线程 ----
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._lock.try_acquire():
+                    self.poll_once()
+                self._tail()
+            except Exception as e:
+                print(f"Error in shared cache poller: {str(e)}")
+            self._stop.wait(config.SHARED_CACHE_POLL_SECONDS)
+
+    def start(self, fetch: Callable, on_rows: Optional[Callable] = None):
+        if self._thread is not None:
+            return
+        self._fetch = fetch
+        self._on_rows = on_rows
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="shared-cache-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._lock.release()
+
+    def status(self) -> Dict:
+        low, high = self.watermarks()
+        return {
+            "leader": self.is_leader,
+            "low": _fmt(low) if low else None,
+            "high": _fmt(high) if high else None,
+        }
@@ -0,0 +1,325 @@
+"""
+app/stats.py  · 按楼栋、按时间桶的可合并统计草图
+
+每个已关闭的时间桶只回源构建一次（count/sum/min/max + DDSketch 分位数草图），
+查询任意时间范围时只需合并桶，代价与桶数成正比，而不是与行数成正比。
+"""
+
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import config
+from .utils import UNKNOWN_BUILDING, to_float_safe, parse_row_time
+
+# 汇总的指标：power 为单行三相有功功率之和，volt/current 每相各计一个样本
+METRICS = ("power", "volt", "current")
+
+# (Building, Floor) → 指标 → 统计量
+MeterKey = Tuple[str, Optional[int]]
+BucketSummary = Dict[MeterKey, Dict[str, "MetricSummary"]]
+
+_MIN_POSITIVE = 1e-9
+
+
+class QuantileSketch:
+    """DDSketch：相对误差为 alpha 的对数分桶分位数草图，可无损合并"""
+
+    def __init__(self, alpha: float = config.STATS_SKETCH_ALPHA):
+        self.alpha = alpha
+        self._gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self._gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def add(self, value: float):
+        if value > _MIN_POSITIVE:
+            k = self._key(value)
+            self.positive[k] = self.positive.get(k, 0) + 1
+        elif value < -_MIN_POSITIVE:
+            k = self._key(-value)
+            self.negative[k] = self.negative.get(k, 0) + 1
+        else:
+            self.zero_count += 1
+        self.count += 1
+
+    def merge(self, other: "QuantileSketch"):
+        for k, c in other.positive.items():
+            self.positive[k] = self.positive.get(k, 0) + c
+        for k, c in other.negative.items():
+            self.negative[k] = self.negative.get(k, 0) + c
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # 负数：绝对值越大越靠前
+        for k in sorted(self.negative, reverse=True):
+            seen += self.negative[k]
+            if seen > rank:
+                return -self._value(k)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for k in sorted(self.positive):
+            seen += self.positive[k]
+            if seen > rank:
+                return self._value(k)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+
+class MetricSummary:
+    """单个指标的可合并汇总：count/sum/min/max + 分位数草图"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.sketch = QuantileSketch()
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.sketch.add(value)
+
+    def merge(self, other: "MetricSummary"):
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+
+    def to_dict(self, quantiles: Iterable[float]) -> Dict:
+        result = {
+            "count": self.count,
+            "sum": self.total,
+            "avg": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "quantiles": {},
+        }
+        for q in quantiles:
+            v = self.sketch.quantile(q)
+            if v is not None:
+                # 草图估计值不应越出真实的最小/最大值
+                v = min(max(v, self.min), self.max)
+            result["quantiles"][quantile_label(q)] = v
+        return result
+
+
+def quantile_label(q: float) -> str:
+    """0.95 → "p95"，0.999 → "p99.9" """
+    return f"p{round(q * 100, 6):g}"
+
+
+def parse_quantiles(text: str) -> List[float]:
+    """解析 "0.5,0.95,0.99"，非法值抛 ValueError"""
+    result = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        q = float(part)
+        if not 0.0 <= q <= 1.0:
+            raise ValueError(f"分位数必须位于 [0, 1]：{part}")
+        result.append(q)
+    return result
+
+
+def _meter_key(row: Dict) -> MeterKey:
+    building = row.get("Building") or UNKNOWN_BUILDING
+    try:
+        floor = int(row.get("Floor"))
+    except (ValueError, TypeError):
+        floor = None
+    return building, floor
+
+
+def build_summary(rows: Iterable[Dict]) -> BucketSummary:
+    """把一批原始行汇总成 {(Building, Floor): {metric: MetricSummary}}"""
+    summary: BucketSummary = {}
+    for row in rows:
+        metrics = summary.get(_meter_key(row))
+        if metrics is None:
+            metrics = {m: MetricSummary() for m in METRICS}
+            summary[_meter_key(row)] = metrics
+        metrics["power"].add(
+            to_float_safe(row.get("power1", 0)) +
+            to_float_safe(row.get("power2", 0)) +
+            to_float_safe(row.get("power3", 0))
+        )
+        for phase in ("1", "2", "3"):
+            metrics["volt"].add(to_float_safe(row.get("volt" + phase, 0)))
+            metrics["current"].add(to_float_safe(row.get("current" + phase, 0)))
+    return summary
+
+
+def _merge_into(target: Dict[str, Dict[str, MetricSummary]], summary: BucketSummary,
+                buildings: Optional[Sequence[str]] = None,
+                floors: Optional[Sequence[int]] = None):
+    """按楼栋合并（同一楼栋不同楼层合在一起），可只合并指定楼栋/楼层"""
+    for (building, floor), metrics in summary.items():
+        if buildings and building not in buildings:
+            continue
+        if floors and floor not in floors:
+            continue
+        dst = target.setdefault(building, {m: MetricSummary() for m in METRICS})
+        for m, s in metrics.items():
+            dst[m].merge(s)
+
+
+class BucketStore:
+    """
+    已关闭时间桶的统计缓存（LRU）。
+
+    fetch(start, end, buildings=None, floors=None) 需返回 [start, end] 内的原始行
+    （与 pma_client.fetch_by_time_range 一致）。
+    """
+
+    def __init__(self,
+                 bucket_minutes: int = config.STATS_BUCKET_MINUTES,
+                 max_buckets: int = config.STATS_MAX_BUCKETS):
+        self.bucket = timedelta(minutes=bucket_minutes)
+        # 容量只影响命中率：查询合并的是本地构建/取到的汇总，被淘汰的桶下次重新回源即可
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[datetime, BucketSummary]" = OrderedDict()
+        self._lock = threading.Lock()        # 保护 _buckets
+        self._build_lock = threading.Lock()  # 避免并发请求重复回源同一批桶
+
+    def align(self, t: datetime) -> datetime:
+        """向下对齐到桶边界"""
+        midnight = t.replace(hour=0, minute=0, second=0, microsecond=0)
+        return midnight + ((t - midnight) // self.bucket) * self.bucket
+
+    def _get(self, start: datetime) -> Optional[BucketSummary]:
+        with self._lock:
+            summary = self._buckets.get(start)
+            if summary is not None:
+                self._buckets.move_to_end(start)
+            return summary
+
+    def _put(self, start: datetime, summary: BucketSummary):
+        with self._lock:
+            self._buckets[start] = summary
+            self._buckets.move_to_end(start)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+
+    def _partition(self, rows: List[Dict], starts: List[datetime]) -> Dict[datetime, List[Dict]]:
+        wanted = {s: [] for s in starts}
+        for row in rows:
+            t = parse_row_time(row)
+            if t is None:
+                continue
+            bucket_rows = wanted.get(self.align(t))
+            if bucket_rows is not None:
+                bucket_rows.append(row)
+        return wanted
+
+    def _build_closed(self, starts: List[datetime], fetch: Callable) -> Tuple[Dict[datetime, BucketSummary], int]:
+        """
+        取得全部已关闭桶的汇总：已缓存的直接取，缺失的回源构建（连续的缺失桶合并成一次查询）。
+        返回 ({桶起点: 汇总}, 回源行数)；结果放在本地字典中，合并时不受 LRU 淘汰影响。
+        """
+        summaries: Dict[datetime, BucketSummary] = {}
+        missing = []
+        for s in starts:
+            summary = self._get(s)
+            if summary is None:
+                missing.append(s)
+            else:
+                summaries[s] = summary
+        if not missing:
+            # 全部命中时不等待其它请求的回源
+            return summaries, 0
+
+        fetched = 0
+        with self._build_lock:
+            runs: List[List[datetime]] = []
+            for s in missing:
+                # 等锁期间可能已被其它请求构建
+                summary = self._get(s)
+                if summary is not None:
+                    summaries[s] = summary
+                    continue
+                if (runs and runs[-1][-1] + self.bucket == s
+                        and len(runs[-1]) < config.STATS_FETCH_MAX_BUCKETS):
+                    runs[-1].append(s)
+                else:
+                    runs.append([s])
+            for run in runs:
+                rows = fetch(run[0], run[-1] + self.bucket)
+                fetched += len(rows)
+                for s, bucket_rows in self._partition(rows, run).items():
+                    summaries[s] = build_summary(bucket_rows)
+                    self._put(s, summaries[s])
+        return summaries, fetched
+
+    def query(self, start: datetime, end: datetime, quantiles: List[float],
+              fetch: Callable, now: Optional[datetime] = None,
+              buildings: Optional[Sequence[str]] = None,
+              floors: Optional[Sequence[int]] = None,
+              settled_until: Optional[datetime] = None) -> Dict:
+        """
+        合并 [start, end] 覆盖的全部桶；起止时间会向外对齐到桶边界。
+        已关闭的桶按全部电表构建并缓存，查询时按 buildings/floors 挑选；
+        尚未关闭的桶（含当前时刻）每次实时计算（过滤条件下推回源），不进入缓存。
+
+        桶在结束 STATS_CLOSE_GRACE_SECONDS 之后才视为关闭，给迟到的行留出时间；
+        settled_until 为数据源已完整的时间（如共享缓存的 high 水位），桶结束时间不能晚于它。
+        """
+        now = now or datetime.now()
+        closed_until = now - timedelta(seconds=config.STATS_CLOSE_GRACE_SECONDS)
+        if settled_until is not None:
+            closed_until = min(closed_until, settled_until)
+        first = self.align(start)
+        last = self.align(end)
+        starts = []
+        s = first
+        while s <= last:
+            starts.append(s)
+            s += self.bucket
+
+        closed = [s for s in starts if s + self.bucket <= closed_until]
+        open_ = [s for s in starts if s + self.bucket > closed_until and s <= now]
+
+        summaries, fetched = self._build_closed(closed, fetch)
+
+        merged: Dict[str, Dict[str, MetricSummary]] = {}
+        for s in closed:
+            _merge_into(merged, summaries[s], buildings, floors)
+        if open_:
+            rows = fetch(open_[0], now, buildings=buildings, floors=floors)
+            fetched += len(rows)
+            for bucket_rows in self._partition(rows, open_).values():
+                _merge_into(merged, build_summary(bucket_rows), buildings, floors)
+
+        return {
+            "start": first.strftime("%Y-%m-%d %H:%M:%S"),
+            "end": (last + self.bucket).strftime("%Y-%m-%d %H:%M:%S"),
+            "bucket_minutes": int(self.bucket.total_seconds() // 60),
+            "bucket_count": len(closed) + len(open_),
+            "fetched_rows": fetched,
+            "buildings": {
+                building: {m: s.to_dict(quantiles) for m, s in metrics.items()}
+                for building, metrics in sorted(merged.items())
+            },
+        }
@@ -0,0 +1,36 @@
+"""
+app/utils.py  · 行数据解析等通用小工具
+"""
+
+from datetime import datetime
+from typing import Dict, Optional
+
+from . import config
+
+# 楼栋为空的行统一记作该名称；按楼栋过滤时它也匹配楼栋为空的行
+UNKNOWN_BUILDING = "UNKNOWN"
+
+_TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S")
+
+
+def to_float_safe(value) -> float:
+    """处理空字符串/None/异常值"""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def parse_row_time(row: Dict) -> Optional[datetime]:
+    """
+    取出一行数据的时间戳（优先排序列，其次 timestamp1），解析失败返回 None
+    """
+    raw = row.get(config.ORDER_BY_COLUMN) or row.get("timestamp1")
+    if not raw:
+        return None
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.strptime(raw, fmt)
+        except ValueError:
+            continue
+    return None
@@ -0,0 +1,61 @@
+"""
+app/warmup.py  · 启动预热进度
+
+lifespan 启动时在后台按顺序执行预热步骤（预加载解析库、提前登录、预计算常用视图），
+/ready 据此告诉负载均衡器何时可以导入流量。
+"""
+
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+Step = Tuple[str, Callable[[], Awaitable]]
+
+
+class WarmUp:
+    """顺序执行预热步骤，记录每一步的状态与耗时；单步失败不影响后续步骤"""
+
+    def __init__(self):
+        self._steps: "OrderedDict[str, Dict]" = OrderedDict()
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._finished_at is not None
+
+    def skip(self):
+        """未启用预热时直接视为就绪"""
+        now = time.monotonic()
+        self._started_at = self._started_at or now
+        self._finished_at = now
+
+    async def run(self, steps: List[Step]):
+        self._started_at = time.monotonic()
+        for name, _ in steps:
+            self._steps[name] = {"state": "pending"}
+
+        for name, func in steps:
+            info = self._steps[name]
+            info["state"] = "running"
+            begin = time.monotonic()
+            try:
+                # 步骤返回 False 表示本进程无需执行该步骤
+                info["state"] = "skipped" if await func() is False else "done"
+            except Exception as e:
+                info["state"] = "failed"
+                info["error"] = str(e)
+                print(f"Error in warm-up step {name}: {str(e)}")
+            info["seconds"] = round(time.monotonic() - begin, 3)
+
+        self._finished_at = time.monotonic()
+
+    def status(self) -> Dict:
+        done = sum(1 for info in self._steps.values() if info["state"] in ("done", "skipped", "failed"))
+        end = self._finished_at or time.monotonic()
+        return {
+            "ready": self.ready,
+            "progress": f"{done}/{len(self._steps)}",
+            "elapsed": round(end - self._started_at, 3) if self._started_at else 0.0,
+            "steps": dict(self._steps),
+        }